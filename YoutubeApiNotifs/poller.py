@@ -0,0 +1,126 @@
+import asyncio
+import random
+import time
+
+DAILY_QUOTA = 8000  # quota units the poller may spend per day, out of YouTube's default 10000
+MIN_INTERVAL = 300
+MAX_INTERVAL = 3600
+DETAILS_BATCH = 50  # videos.list accepts up to 50 ids per call
+# Many more ids are remembered than fetched per poll, so an older upload that moves into
+# the fetched window after a newer one is deleted or made private isn't announced again.
+# Both counts cost one quota unit, playlistItems.list returns up to 50 ids per call.
+FETCH_COUNT = 5
+SEEN_LIMIT = 50
+
+
+class UploadPoller:
+    """Polls each followed creator once, no matter how many guilds follow it.
+
+    ``source`` provides two coroutines, which lets a local stand-in replace the
+    YouTube API:
+
+    - ``latest_uploads(creator_id, count)`` returns the ``count`` newest video ids,
+      newest first.
+    - ``video_details(video_ids)`` returns a dict of ``video id -> details`` for
+      at most ``DETAILS_BATCH`` ids.
+
+    ``announce(creator_id, videos)`` is awaited with the details of every new
+    video, oldest first. Each poll costs one quota unit, so polls are spread
+    over ``daily_quota``; creators that haven't uploaded recently back off
+    towards ``max_interval``.
+    """
+
+    def __init__(self, source, announce, daily_quota=DAILY_QUOTA,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, clock=time.monotonic):
+        self.source = source
+        self.announce = announce
+        self.daily_quota = daily_quota
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.creators = {}  # creator id -> {"seen", "interval", "next_poll"}
+
+    def base_interval(self):
+        """The shortest interval that keeps every creator's polls within the daily quota."""
+        return max(self.min_interval, len(self.creators) * 86400 / self.daily_quota)
+
+    def sync(self, creator_ids, last_seen):
+        """Follow exactly ``creator_ids``, seeding new ones with persisted ``last_seen`` ids."""
+        for creator_id in set(self.creators) - set(creator_ids):
+            del self.creators[creator_id]
+
+        added = [creator_id for creator_id in creator_ids if creator_id not in self.creators]
+        for creator_id in added:
+            self.creators[creator_id] = {"seen": last_seen.get(creator_id)}
+
+        # Spread the first polls over one interval instead of bursting them all at once
+        now = self.clock()
+        base = self.base_interval()
+        for creator_id in added:
+            self.creators[creator_id]["interval"] = base
+            self.creators[creator_id]["next_poll"] = now + random.uniform(0, base)
+
+    async def poll(self):
+        """Poll every creator that is due and announce new videos.
+
+        Returns a dict of ``creator id -> seen video ids`` for the creators whose
+        seen ids changed, so the caller can persist them.
+        """
+        now = self.clock()
+        due = [creator_id for creator_id, state in self.creators.items() if state["next_poll"] <= now]
+        if not due:
+            return {}
+
+        results = await asyncio.gather(*(
+            # The first poll remembers a full SEEN_LIMIT ids, later ones only look for new videos
+            self.source.latest_uploads(
+                creator_id, SEEN_LIMIT if self.creators[creator_id]["seen"] is None else FETCH_COUNT
+            )
+            for creator_id in due
+        ), return_exceptions=True)
+
+        base = self.base_interval()
+        changed = {}
+        new_videos = {}
+        for creator_id, uploads in zip(due, results):
+            state = self.creators[creator_id]
+            if isinstance(uploads, Exception):
+                print(f"Failed to poll YouTube channel {creator_id}: {uploads}")
+            elif state["seen"] is None:
+                # First poll of this creator, don't announce its back catalogue
+                state["seen"] = uploads[:SEEN_LIMIT]
+                changed[creator_id] = state["seen"]
+            else:
+                fresh = [video_id for video_id in uploads if video_id not in state["seen"]]
+                if fresh:
+                    new_videos[creator_id] = fresh[::-1]
+                    state["seen"] = (fresh + state["seen"])[:SEEN_LIMIT]
+                    changed[creator_id] = state["seen"]
+
+            if creator_id in new_videos:
+                state["interval"] = base
+            else:
+                state["interval"] = min(max(state["interval"], base) * 1.5, max(self.max_interval, base))
+            state["next_poll"] = now + state["interval"]
+
+        if new_videos:
+            details = await self.fetch_details(
+                [video_id for videos in new_videos.values() for video_id in videos]
+            )
+            announced = await asyncio.gather(*(
+                self.announce(creator_id, [details.get(video_id, {"id": video_id}) for video_id in videos])
+                for creator_id, videos in new_videos.items()
+            ), return_exceptions=True)
+            for creator_id, result in zip(new_videos, announced):
+                if isinstance(result, Exception):
+                    print(f"Failed to announce new videos of YouTube channel {creator_id}: {result}")
+        return changed
+
+    async def fetch_details(self, video_ids):
+        details = {}
+        for start in range(0, len(video_ids), DETAILS_BATCH):
+            try:
+                details.update(await self.source.video_details(video_ids[start:start + DETAILS_BATCH]))
+            except Exception as e:
+                print(f"Failed to fetch YouTube video details: {e}")
+        return details
@@ -1,15 +1,206 @@
+import asyncio
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
 import discord
+from discord.ext import tasks
 from redbot.core import commands, Config
 import googleapiclient.discovery
+import googleapiclient.errors
+
+from .poller import UploadPoller
+
+RESULT_TTL = 120  # seconds a channel's newest video is reused for, across all guilds
+FEED_URL = "https://www.youtube.com/feeds/videos.xml?channel_id={}"
+FEED_NS = {"atom": "http://www.w3.org/2005/Atom", "yt": "http://www.youtube.com/xml/schemas/2015"}
 
 class YoutubeApiNotifs(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.config = Config.get_conf(self, identifier="youtube_api_notifs")
         default_guild_settings = {
-            "api_key": ""
+            "api_key": "",
+            "subscriptions": {}  # YouTube channel id -> Discord channel ids to announce in
         }
         self.config.register_guild(**default_guild_settings)
+        self.config.register_global(
+            uploads_playlists={},  # channel id -> uploads playlist id
+            last_seen={}  # channel id -> newest video ids already announced
+        )
+        self.clients = {}  # api key -> built YouTube client
+        # api key -> worker thread for that client. Each client has its own httplib2
+        # connection, which isn't thread-safe, so calls with the same key run one at
+        # a time while different keys (a guild's ytquery vs. the poller) don't wait
+        # on each other.
+        self.executors = {}
+        self.latest_videos = {}  # channel id -> (expires_at, video id)
+        self.session = None
+        self.poller = UploadPoller(self, self.announce)
+
+    async def cog_load(self):
+        self.session = aiohttp.ClientSession()
+        self.poll_uploads.start()
+
+    async def cog_unload(self):
+        self.poll_uploads.cancel()
+        if self.session:
+            await self.session.close()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+    async def run_blocking(self, api_key, func, *args, **kwargs):
+        """Run a blocking googleapiclient call in the worker thread of ``api_key``'s client."""
+        executor = self.executors.get(api_key)
+        if executor is None:
+            executor = self.executors[api_key] = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+
+    async def get_client(self, api_key):
+        client = self.clients.get(api_key)
+        if client is None:
+            client = await self.run_blocking(
+                api_key, googleapiclient.discovery.build, 'youtube', 'v3', developerKey=api_key, cache_discovery=False
+            )
+            self.clients[api_key] = client
+        return client
+
+    async def get_uploads_playlist(self, api_key, channel_id):
+        """Return the id of the channel's uploads playlist, resolving it only once."""
+        playlists = await self.config.uploads_playlists()
+        if channel_id in playlists:
+            return playlists[channel_id]
+
+        youtube = await self.get_client(api_key)
+        response = await self.run_blocking(
+            api_key, youtube.channels().list(part='contentDetails', id=channel_id).execute
+        )
+        if not response.get('items'):
+            return None
+        playlist_id = response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
+        await self.config.uploads_playlists.set_raw(channel_id, value=playlist_id)
+        return playlist_id
+
+    async def fetch_uploads(self, channel_id, api_key, count):
+        playlist_id = await self.get_uploads_playlist(api_key, channel_id)
+        if playlist_id is None:
+            return []
+
+        # playlistItems.list costs 1 quota unit, search.list would cost 100
+        youtube = await self.get_client(api_key)
+        response = await self.run_blocking(
+            api_key, youtube.playlistItems().list(part='contentDetails', playlistId=playlist_id, maxResults=count).execute
+        )
+        return [item['contentDetails']['videoId'] for item in response.get('items', [])]
+
+    async def fetch_latest_from_api(self, channel_id, api_key):
+        uploads = await self.fetch_uploads(channel_id, api_key, 1)
+        return uploads[0] if uploads else None
+
+    async def fetch_latest_from_feed(self, channel_id):
+        async with self.session.get(FEED_URL.format(channel_id)) as resp:
+            if resp.status == 404:
+                return None
+            resp.raise_for_status()
+            feed = ET.fromstring(await resp.text())
+        video_id = feed.find('atom:entry/yt:videoId', FEED_NS)
+        return video_id.text if video_id is not None else None
+
+    async def fetch_latest_video(self, channel_id, api_key):
+        """Return the id of the channel's newest video, using the public feed if there's no API key."""
+        cached = self.latest_videos.get(channel_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        if api_key:
+            video_id = await self.fetch_latest_from_api(channel_id, api_key)
+        else:
+            video_id = await self.fetch_latest_from_feed(channel_id)
+        self.latest_videos[channel_id] = (time.monotonic() + RESULT_TTL, video_id)
+        return video_id
+
+    async def get_poll_api_key(self):
+        youtube_keys = await self.bot.get_shared_api_tokens("youtube")
+        return youtube_keys.get("api_key")
+
+    async def latest_uploads(self, channel_id, count):
+        """Newest video ids of a channel, used by the upload poller.
+
+        All poller calls share the bot-wide key's worker thread, so they run one at a time.
+        """
+        api_key = await self.get_poll_api_key()
+        return await self.fetch_uploads(channel_id, api_key, count)
+
+    async def video_details(self, video_ids):
+        """Snippets of up to 50 videos in a single videos.list call, used by the upload poller."""
+        api_key = await self.get_poll_api_key()
+        youtube = await self.get_client(api_key)
+        response = await self.run_blocking(
+            api_key, youtube.videos().list(part='snippet', id=','.join(video_ids), maxResults=len(video_ids)).execute
+        )
+        return {
+            item['id']: {
+                "id": item['id'],
+                "title": item['snippet']['title'],
+                "channel_title": item['snippet']['channelTitle'],
+            }
+            for item in response.get('items', [])
+        }
+
+    async def announce(self, channel_id, videos):
+        """Post new videos to every Discord channel subscribed to the YouTube channel."""
+        all_guilds = await self.config.all_guilds()
+        targets = []
+        for guild_data in all_guilds.values():
+            for target_id in guild_data["subscriptions"].get(channel_id, []):
+                target = self.bot.get_channel(target_id)
+                if target:
+                    targets.append(target)
+
+        messages = []
+        for video in videos:
+            video_link = f"https://www.youtube.com/watch?v={video['id']}"
+            if "title" in video:
+                messages.append(f"**{video['channel_title']}** uploaded a new video: {video['title']}\n{video_link}")
+            else:
+                messages.append(f"New video: {video_link}")
+
+        await asyncio.gather(*(self.send_messages(target, messages) for target in targets))
+
+    async def send_messages(self, channel, messages):
+        for message in messages:
+            try:
+                await channel.send(message)
+            except discord.HTTPException as e:
+                print(f"Failed to announce in channel {channel.id}: {e}")
+                return
+
+    @tasks.loop(seconds=60)
+    async def poll_uploads(self):
+        if not await self.get_poll_api_key():
+            return
+
+        all_guilds = await self.config.all_guilds()
+        creator_ids = {
+            channel_id
+            for guild_data in all_guilds.values()
+            for channel_id, targets in guild_data["subscriptions"].items()
+            if targets
+        }
+        self.poller.sync(creator_ids, await self.config.last_seen())
+
+        changed = await self.poller.poll()
+        if changed:
+            async with self.config.last_seen() as last_seen:
+                last_seen.update(changed)
+                for channel_id in set(last_seen) - creator_ids:
+                    del last_seen[channel_id]
+
+    @poll_uploads.before_loop
+    async def before_poll_uploads(self):
+        await self.bot.wait_until_red_ready()
 
     @commands.command()
     async def setapikey(self, ctx, api_key: str):
@@ -22,32 +213,88 @@ class YoutubeApiNotifs(commands.Cog):
     async def ytquery(self, ctx, channel_id: str):
         """Get the link to the newest video of a channel."""
         api_key = await self.config.guild(ctx.guild).api_key()
-        if not api_key:
-            await ctx.send("The YouTube API key has not been set. Use `[p]setapikey <api_key>` to set it.")
-            return
-        
-        youtube = googleapiclient.discovery.build('youtube', 'v3', developerKey=api_key)
 
         try:
-            response = youtube.search().list(
-                part='id',
-                channelId=channel_id,
-                order='date',
-                type='video',
-                maxResults=1
-            ).execute()
-
-            if 'items' in response:
-                video_id = response['items'][0]['id']['videoId']
-                video_link = f"https://www.youtube.com/watch?v={video_id}"
-                await ctx.send(f"Newest Video Link: {video_link}")
-            else:
-                await ctx.send("No videos found on the channel.")
+            video_id = await self.fetch_latest_video(channel_id, api_key)
         except googleapiclient.errors.HttpError as e:
             if "API key expired" in str(e):
                 await ctx.send("API key for YouTube has expired. Please renew the API key.")
             else:
                 await ctx.send("An error occurred while fetching data from the YouTube API.")
+            return
+        except (aiohttp.ClientError, ET.ParseError):
+            await ctx.send("An error occurred while fetching the channel's video feed.")
+            return
+
+        if video_id:
+            video_link = f"https://www.youtube.com/watch?v={video_id}"
+            await ctx.send(f"Newest Video Link: {video_link}")
+        else:
+            await ctx.send("No videos found on the channel.")
+
+    @commands.group()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    async def ytnotify(self, ctx):
+        """Announce new uploads of YouTube channels.
+
+        Polling uses the bot-wide key set with `[p]set api youtube api_key,<key>`.
+        """
+
+    @ytnotify.command(name="add")
+    async def ytnotify_add(self, ctx, channel_id: str, channel: discord.TextChannel):
+        """Announce new videos of a YouTube channel in a Discord channel.
+
+        `channel_id` is the channel's `UC...` id, not its handle or URL.
+        """
+        api_key = await self.get_poll_api_key()
+        if not api_key:
+            await ctx.send("No YouTube API key is set for the bot. The owner can set one with `[p]set api youtube api_key,<key>`.")
+            return
+
+        # Resolve the uploads playlist now, so unknown ids never reach the poller
+        try:
+            playlist_id = await self.get_uploads_playlist(api_key, channel_id)
+        except googleapiclient.errors.HttpError:
+            await ctx.send("An error occurred while fetching data from the YouTube API.")
+            return
+        if playlist_id is None:
+            await ctx.send(f"`{channel_id}` is not a YouTube channel id.")
+            return
+
+        async with self.config.guild(ctx.guild).subscriptions() as subscriptions:
+            targets = subscriptions.setdefault(channel_id, [])
+            if channel.id in targets:
+                await ctx.send(f"{channel.mention} is already subscribed to `{channel_id}`.")
+                return
+            targets.append(channel.id)
+        await ctx.send(f"New videos of `{channel_id}` will be announced in {channel.mention}.")
+
+    @ytnotify.command(name="remove")
+    async def ytnotify_remove(self, ctx, channel_id: str, channel: discord.TextChannel):
+        """Stop announcing a YouTube channel in a Discord channel."""
+        async with self.config.guild(ctx.guild).subscriptions() as subscriptions:
+            targets = subscriptions.get(channel_id, [])
+            if channel.id not in targets:
+                await ctx.send(f"{channel.mention} is not subscribed to `{channel_id}`.")
+                return
+            targets.remove(channel.id)
+            if not targets:
+                del subscriptions[channel_id]
+        await ctx.send(f"{channel.mention} will no longer get videos of `{channel_id}`.")
+
+    @ytnotify.command(name="list")
+    async def ytnotify_list(self, ctx):
+        """List the YouTube channels announced in this server."""
+        subscriptions = await self.config.guild(ctx.guild).subscriptions()
+        if not subscriptions:
+            await ctx.send("No YouTube channels are being announced.")
+            return
+        lines = [
+            f"`{channel_id}`: " + ", ".join(f"<#{target_id}>" for target_id in targets)
+            for channel_id, targets in subscriptions.items()
+        ]
+        await ctx.send("\n".join(lines))
 
 def setup(bot):
     bot.add_cog(YoutubeApiNotifs(bot))
@@ -1,44 +1,184 @@
+import datetime
+import time
+from collections import defaultdict, deque
+
+import aiohttp
 import discord
-from redbot.core import commands
-from github import Github, GithubException
+from discord.ext import tasks
+from redbot.core import commands, Config
+
+from .repostats import repo_stats
+
+# Discord only allows about 2 channel renames per channel every 10 minutes
+RENAME_LIMIT = 2
+RENAME_WINDOW = 600
+
 
 class githubstarupdater(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.config = Config.get_conf(self, identifier=1402174053, force_registration=True)
+        self.config.register_guild(subscriptions={})  # channel id -> {"repo", "format"}
+        self.session = None
+        self.renames = defaultdict(deque)  # channel id -> timestamps of recent renames
 
-    async def fetch_stars(self, repo_url, api_key):
-        try:
-            # Initialize PyGithub with the access token
-            auth = Github(api_key)
-            
-            # Extract owner and repo name from the URL
-            parts = repo_url.strip("/").split("/")
-            if len(parts) >= 2:
-                owner = parts[-2]
-                repo_name = parts[-1]
-
-                repo = auth.get_repo(f"{owner}/{repo_name}")
-                stars = repo.stargazers_count
-                return stars
-        except GithubException as e:
-            print(f"GitHub API error: {e}")
-        except Exception as e:
-            print(f"Failed to fetch stars: {e}")
+    async def cog_load(self):
+        self.session = aiohttp.ClientSession()
+        self.refresh_stars.start()
+
+    async def cog_unload(self):
+        self.refresh_stars.cancel()
+        if self.session:
+            await self.session.close()
 
+    @staticmethod
+    def parse_repo(repo_url):
+        """Turn a GitHub URL or ``owner/repo`` string into ``owner/repo``."""
+        parts = repo_url.strip("/").split("/")
+        if len(parts) >= 2:
+            return f"{parts[-2]}/{parts[-1]}"
         return None
 
+    async def fetch_stars(self, repo_url, api_key):
+        stats = await self.fetch_stats(repo_url, api_key)
+        return stats["stars"] if stats else None
+
+    async def fetch_stats(self, repo_url, api_key):
+        repo = self.parse_repo(repo_url)
+        if repo is None:
+            return None
+        return await repo_stats.get(self.session, repo, api_key)
+
+    @staticmethod
+    def render(message_format, stats):
+        """Fill ``{count}``/``{stars}``, ``{forks}``, ``{watchers}`` and ``{issues}``."""
+        name = message_format.replace("{count}", str(stats["stars"]))
+        for key, value in stats.items():
+            name = name.replace(f"{{{key}}}", str(value))
+        return name
+
+    async def rename_channel(self, channel, name):
+        """Rename the channel if the name changed and the rename budget allows it."""
+        if channel.name == name:
+            return False
+
+        now = time.monotonic()
+        history = self.renames[channel.id]
+        while history and now - history[0] >= RENAME_WINDOW:
+            history.popleft()
+        if len(history) >= RENAME_LIMIT:
+            return False
+
+        await channel.edit(name=name)
+        history.append(now)
+        return True
+
+    @tasks.loop(minutes=5)
+    async def refresh_stars(self):
+        github_keys = await self.bot.get_shared_api_tokens("github")
+        api_key = github_keys.get("api_key")
+        if not api_key:
+            return
+
+        all_guilds = await self.config.all_guilds()
+        subscriptions = [
+            (int(channel_id), sub)
+            for guild_data in all_guilds.values()
+            for channel_id, sub in guild_data["subscriptions"].items()
+        ]
+        stats_by_repo = await repo_stats.get_many(
+            self.session, [sub["repo"] for _, sub in subscriptions], api_key
+        )
+
+        for channel_id, sub in subscriptions:
+            stats = stats_by_repo.get(sub["repo"])
+            channel = self.bot.get_channel(channel_id)
+            if stats is None or channel is None:
+                continue
+            try:
+                await self.rename_channel(channel, self.render(sub["format"], stats))
+            except discord.HTTPException as e:
+                print(f"Failed to rename channel {channel_id}: {e}")
+
+    @refresh_stars.before_loop
+    async def before_refresh_stars(self):
+        await self.bot.wait_until_red_ready()
+
     @commands.command()
     async def updatestars(self, ctx, channel: discord.VoiceChannel, repo_url: str, message_format: str):
         """Update the channel's name with the star count of a GitHub repository."""
         github_keys = await self.bot.get_shared_api_tokens("github")
         api_key = github_keys.get("api_key")
         if api_key:
-            stars = await self.fetch_stars(repo_url, api_key)
-            if stars is not None:
-                updated_name = message_format.replace("{count}", str(stars))
-                await channel.edit(name=updated_name)
-                await ctx.send(f"Updated {channel.mention} with {stars} Stars.")
+            stats = await self.fetch_stats(repo_url, api_key)
+            if stats is not None:
+                stars = stats["stars"]
+                updated_name = self.render(message_format, stats)
+                if channel.name == updated_name:
+                    await ctx.send(f"{channel.mention} already shows {stars} Stars.")
+                elif await self.rename_channel(channel, updated_name):
+                    await ctx.send(f"Updated {channel.mention} with {stars} Stars.")
+                else:
+                    await ctx.send(f"{channel.mention} was renamed too recently, try again in a few minutes.")
             else:
                 await ctx.send(f"Failed to fetch stars for {repo_url}.")
         else:
             await ctx.send("GitHub API key is not set. Please set it using Red's API store.")
+
+    @commands.group()
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_channels=True)
+    async def trackstars(self, ctx):
+        """Keep channel names updated with GitHub star counts."""
+
+    @trackstars.command(name="add")
+    async def trackstars_add(self, ctx, channel: discord.VoiceChannel, repo_url: str, message_format: str):
+        """Track a repository's stats in a channel's name, e.g. `{stars} Stars | {forks} Forks`.
+
+        Available placeholders: `{count}`/`{stars}`, `{forks}`, `{watchers}` and `{issues}`.
+        """
+        repo = self.parse_repo(repo_url)
+        if repo is None:
+            await ctx.send(f"`{repo_url}` is not a valid GitHub repository.")
+            return
+        async with self.config.guild(ctx.guild).subscriptions() as subscriptions:
+            subscriptions[str(channel.id)] = {"repo": repo, "format": message_format}
+        await ctx.send(f"{channel.mention} will now track the stars of {repo}.")
+
+    @trackstars.command(name="remove")
+    async def trackstars_remove(self, ctx, channel: discord.VoiceChannel):
+        """Stop tracking stars in a channel."""
+        async with self.config.guild(ctx.guild).subscriptions() as subscriptions:
+            removed = subscriptions.pop(str(channel.id), None)
+        if removed:
+            await ctx.send(f"{channel.mention} no longer tracks {removed['repo']}.")
+        else:
+            await ctx.send(f"{channel.mention} is not tracking any repository.")
+
+    @trackstars.command(name="list")
+    async def trackstars_list(self, ctx):
+        """List the channels tracking star counts in this server."""
+        subscriptions = await self.config.guild(ctx.guild).subscriptions()
+        if not subscriptions:
+            await ctx.send("No channels are tracking star counts.")
+            return
+        lines = [
+            f"<#{channel_id}>: {sub['repo']} (`{sub['format']}`)"
+            for channel_id, sub in subscriptions.items()
+        ]
+        await ctx.send("\n".join(lines))
+
+    @trackstars.command(name="ratelimit")
+    async def trackstars_ratelimit(self, ctx):
+        """Show the GitHub API rate limit left for the bot's token."""
+        if not repo_stats.rate_limits:
+            await ctx.send("No GitHub requests have been made yet.")
+            return
+        lines = []
+        for resource, limits in sorted(repo_stats.rate_limits.items()):
+            reset = datetime.datetime.fromtimestamp(limits["reset"], tz=datetime.timezone.utc)
+            lines.append(
+                f"{resource}: {limits['remaining']}/{limits['limit']} left, "
+                f"resets {discord.utils.format_dt(reset, 'R')}"
+            )
+        await ctx.send("\n".join(lines))
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+GITHUB_API = "https://api.github.com"
+GRAPHQL_BATCH = 50  # repositories fetched per GraphQL query
+# Deliberately shorter than the 5 minute refresh loop, so every refresh refetches and
+# only manual lookups between refreshes are served from the cache. Refetching an
+# unchanged repo is still free thanks to the conditional REST requests.
+STATS_TTL = 240
+
+REPO_FIELDS = """
+    stargazerCount
+    forkCount
+    watchers { totalCount }
+    issues(states: OPEN) { totalCount }
+    pullRequests(states: OPEN) { totalCount }
+"""
+
+
+class RepoStatsCache:
+    """Repository stats shared by every guild, keyed by ``owner/repo``.
+
+    Each record holds ``stars``, ``forks``, ``watchers`` and ``issues`` (open
+    issues and pull requests, like GitHub's ``open_issues_count``). Lookups for a
+    repo that is already being fetched wait for that request instead of
+    starting another one.
+    """
+
+    def __init__(self, ttl=STATS_TTL):
+        self.ttl = ttl
+        self.entries = {}  # repo -> (expires_at, stats)
+        self.etags = {}  # repo -> (etag, stats) of the last REST 200 response
+        self.pending = {}  # repo -> future of an in-flight lookup
+        self.rate_limits = {}  # resource ("core", "graphql") -> {"limit", "remaining", "reset"}
+
+    def cached(self, repo):
+        entry = self.entries.get(repo)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def store(self, repo, stats):
+        if stats is not None:
+            self.entries[repo] = (time.monotonic() + self.ttl, stats)
+
+    def record_rate_limit(self, headers):
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        resource = headers.get("X-RateLimit-Resource", "core")
+        self.rate_limits[resource] = {
+            "limit": int(headers.get("X-RateLimit-Limit", 0)),
+            "remaining": int(headers["X-RateLimit-Remaining"]),
+            "reset": int(headers.get("X-RateLimit-Reset", 0)),
+        }
+
+    async def get(self, session, repo, api_key):
+        """Return the stats of one repository, or ``None`` if it can't be fetched."""
+        stats = self.cached(repo)
+        if stats is not None:
+            return stats
+        if repo in self.pending:
+            return await asyncio.shield(self.pending[repo])
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[repo] = future
+        stats = None
+        try:
+            stats = await self.fetch_rest(session, repo, api_key)
+            self.store(repo, stats)
+        finally:
+            del self.pending[repo]
+            future.set_result(stats)
+        return stats
+
+    async def get_many(self, session, repos, api_key):
+        """Return a dict of ``repo -> stats`` for many repositories at once.
+
+        Uses conditional REST requests, switching to GraphQL batches when the core
+        rate limit runs low (see ``fetch_missing``).
+        """
+        results = {}
+        waiting = {}
+        missing = []
+        for repo in dict.fromkeys(repos):
+            stats = self.cached(repo)
+            if stats is not None:
+                results[repo] = stats
+            elif repo in self.pending:
+                waiting[repo] = self.pending[repo]
+            else:
+                missing.append(repo)
+
+        loop = asyncio.get_running_loop()
+        futures = {repo: loop.create_future() for repo in missing}
+        self.pending.update(futures)
+        fetched = {}
+        try:
+            fetched = await self.fetch_missing(session, missing, api_key)
+            for repo, stats in fetched.items():
+                self.store(repo, stats)
+        finally:
+            for repo, future in futures.items():
+                del self.pending[repo]
+                future.set_result(fetched.get(repo))
+        results.update(fetched)
+
+        for repo, future in waiting.items():
+            results[repo] = await asyncio.shield(future)
+        return results
+
+    async def fetch_missing(self, session, repos, api_key):
+        # A conditional REST request is free when the repo hasn't changed (304) but costs
+        # one core request when it has. A GraphQL query costs one point for up to
+        # GRAPHQL_BATCH repos, changed or not. Prefer REST and only batch through GraphQL
+        # when the core limit left can't cover one request per repo.
+        core = self.rate_limits.get("core")
+        if core is None or core["remaining"] >= len(repos):
+            return await self.fetch_rest_many(session, repos, api_key)
+
+        results = {}
+        for start in range(0, len(repos), GRAPHQL_BATCH):
+            batch = repos[start:start + GRAPHQL_BATCH]
+            fetched = await self.fetch_graphql(session, batch, api_key)
+            if fetched is None:
+                # The whole query failed, fall back to conditional REST requests
+                fetched = await self.fetch_rest_many(session, batch, api_key)
+            results.update(fetched)
+        return results
+
+    async def fetch_rest_many(self, session, repos, api_key):
+        results = {}
+        for repo in repos:
+            stats = await self.fetch_rest(session, repo, api_key)
+            if stats is not None:
+                results[repo] = stats
+        return results
+
+    async def fetch_rest(self, session, repo, api_key):
+        headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {api_key}",
+        }
+        cached = self.etags.get(repo)
+        if cached:
+            # Unchanged repos answer 304, which does not count against the rate limit
+            headers["If-None-Match"] = cached[0]
+
+        try:
+            async with session.get(f"{GITHUB_API}/repos/{repo}", headers=headers) as resp:
+                self.record_rate_limit(resp.headers)
+                if resp.status == 304 and cached:
+                    return cached[1]
+                if resp.status != 200:
+                    print(f"GitHub API error: {resp.status} for {repo}")
+                    return None
+                data = await resp.json()
+                etag = resp.headers.get("ETag")
+        except aiohttp.ClientError as e:
+            print(f"Failed to fetch repository stats: {e}")
+            return None
+
+        stats = {
+            "stars": data["stargazers_count"],
+            "forks": data["forks_count"],
+            "watchers": data["subscribers_count"],
+            "issues": data["open_issues_count"],
+        }
+        if etag:
+            self.etags[repo] = (etag, stats)
+        return stats
+
+    async def fetch_graphql(self, session, repos, api_key):
+        """Fetch a batch of repositories in one query, or return ``None`` if the query failed."""
+        aliases = []
+        for index, repo in enumerate(repos):
+            owner, name = repo.split("/", 1)
+            aliases.append(
+                f"r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{{REPO_FIELDS}}}"
+            )
+        query = "query { %s }" % " ".join(aliases)
+
+        try:
+            async with session.post(
+                f"{GITHUB_API}/graphql",
+                json={"query": query},
+                headers={"Authorization": f"Bearer {api_key}"},
+            ) as resp:
+                self.record_rate_limit(resp.headers)
+                if resp.status != 200:
+                    print(f"GitHub API error: {resp.status} for a batch of {len(repos)} repositories")
+                    return None
+                payload = await resp.json()
+        except aiohttp.ClientError as e:
+            print(f"Failed to fetch repository stats: {e}")
+            return None
+
+        data = payload.get("data") or {}
+        results = {}
+        for index, repo in enumerate(repos):
+            node = data.get(f"r{index}")
+            if node is None:
+                continue  # Missing or private repository, reported in payload["errors"]
+            results[repo] = {
+                "stars": node["stargazerCount"],
+                "forks": node["forkCount"],
+                "watchers": node["watchers"]["totalCount"],
+                "issues": node["issues"]["totalCount"] + node["pullRequests"]["totalCount"],
+            }
+        return results
+
+
+repo_stats = RepoStatsCache()